@@ -8,6 +8,7 @@ import uuid
 from io import StringIO
 from typing import List, Optional
 import ast
+from contextlib import asynccontextmanager
 import markdown
 from bs4 import BeautifulSoup
 import pandas as pd
@@ -25,6 +26,7 @@ from fastapi import (
     UploadFile
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import APIKeyHeader
 from llama_index.core import Document, VectorStoreIndex
@@ -34,7 +36,8 @@ from pydantic import BaseModel
 from scripts.format_response import format_response_to_markdown
 from src.agents.agents import *
 from src.agents.retrievers.retrievers import *
-from src.managers.ai_manager import AI_Manager
+from src.managers.ai_manager import AI_Manager, usage_collector
+from src.managers.chat_manager import background_executor as chat_background_executor
 from src.managers.session_manager import SessionManager
 from src.routes.analytics_routes import router as analytics_router
 from src.routes.chat_routes import router as chat_router
@@ -323,9 +326,12 @@ class AppState:
         return dspy.Predict(self.chat_name_agent)
 
     def get_deep_analyzer(self, session_id: str):
-        """Get or create deep analysis module for a session"""
-        session_state = self.get_session_state(session_id)
-        if not hasattr(session_state, 'deep_analyzer') or session_state.get('deep_analyzer') is None:
+        """Get the deep analysis module, building it once per process.
+
+        The module keeps no per-session state (the LM is applied via dspy.context and the
+        DataFrame is passed per call), so every session shares the same instance.
+        """
+        if self.deep_analyzer is None:
             # Create agents dictionary for deep analysis
             deep_agents = {
                 "planner_data_viz_agent": dspy.asyncify(dspy.ChainOfThought(planner_data_viz_agent)),
@@ -335,12 +341,20 @@ class AppState:
             }
             
             deep_agents_desc = PLANNER_AGENTS_WITH_DESCRIPTION
-            session_state['deep_analyzer'] = deep_analysis_module(agents=deep_agents, agents_desc=deep_agents_desc)
+            self.deep_analyzer = deep_analysis_module(agents=deep_agents, agents_desc=deep_agents_desc)
         
-        return session_state['deep_analyzer']
+        return self.deep_analyzer
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Store usage rows still buffered by the collector before the event loop stops
+    await usage_collector.aclose()
+    # Let pending chat title updates finish instead of cutting them off mid-write
+    await asyncio.to_thread(chat_background_executor.shutdown, wait=True)
 
 # Initialize FastAPI app with state
-app = FastAPI(title="AI Analytics API", version="1.0")
+app = FastAPI(title="AI Analytics API", version="1.0", lifespan=lifespan)
 app.state = AppState()
 
 # Configure middleware
@@ -395,6 +409,19 @@ app.add_middleware(
     max_age=600  # Cache preflight requests for 10 minutes (for performance)
 )
 
+# Server-sent event routes; gzip would hold their chunks back until the compressor flushes
+STREAMING_PATHS = {"/chat", "/deep_analysis_streaming"}
+
+class NonStreamingGZipMiddleware(GZipMiddleware):
+    """Gzip larger responses (HTML reports, chat histories) except the event streams"""
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in STREAMING_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+app.add_middleware(NonStreamingGZipMiddleware, minimum_size=1000, compresslevel=6)
+
 # Add these constants at the top of the file with other imports/constants
 RESPONSE_ERROR_INVALID_QUERY = "Please provide a valid query..."
 RESPONSE_ERROR_NO_DATASET = "No dataset is currently loaded. Please link a dataset before proceeding with your analysis."
@@ -1031,13 +1058,16 @@ async def _generate_deep_analysis_stream(session_state: dict, goal: str, session
                                 if "synthesis" in content and content["synthesis"]:
                                     report.synthesis = json.dumps(content["synthesis"])
                         
+                        # One clock read per update so end_time and updated_at agree
+                        now = datetime.now(UTC)
+                        
                         # For the final step, update the HTML report
                         if step == "completed" and content:
                             report.html_report = content
-                            report.end_time = datetime.now(UTC)
+                            report.end_time = now
                             report.duration_seconds = int((report.end_time - report.start_time).total_seconds())
                             
-                        report.updated_at = datetime.now(UTC)
+                        report.updated_at = now
                         db_session.commit()
                         
                 except Exception as e:
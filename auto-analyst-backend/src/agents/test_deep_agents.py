@@ -11,11 +11,17 @@ import pandas as pd
 from dotenv import load_dotenv
 from src.utils.logger import Logger
 import logging
-from datetime import datetime, UTC
+from functools import lru_cache
 import re
+import time
 logger = Logger("deep_agents", see_time=True, console_log=False)
 load_dotenv()
 
+# A `try` missing its colon (whole word only, so `retry` at a line end is left alone)
+BARE_TRY_RE = re.compile(r'\btry\n')
+# Body of the first ```python fenced block (to the closing fence or end of text)
+PYTHON_BLOCK_RE = re.compile(r"```python(.*?)(?:```|\Z)", re.DOTALL)
+
 class deep_questions(dspy.Signature):
     """
 You are a data analysis assistant.
@@ -256,16 +262,14 @@ def score_code(args, code):
     """
     code_text = code.combined_code
     try:
-        # Check if code contains markdown code block markers
-        if "```python" in code_text:
-            code_text = code_text.replace('"""', "'''")
-            parts = code_text.split("```python")
-            code_text = parts[1].split("```")[0] if len(parts) > 1 else code_text
-        else:
-            code_text = code_text.replace('"""', "'''")
+        code_text = code_text.replace('"""', "'''")
+        # Keep only the ```python block if the code is fenced
+        match = PYTHON_BLOCK_RE.search(code_text)
+        if match:
+            code_text = match.group(1)
         
         # Fix try statement syntax
-        code_text = code_text.replace('try\n', 'try:\n')
+        code_text = BARE_TRY_RE.sub('try:\n', code_text)
         
         # Remove code patterns that would make the code unrunnable
         invalid_patterns = [
@@ -601,6 +605,47 @@ Chart Styling Guidelines:
 """
 
 
+def extract_block_code(c):
+    """Pull the python code out of one agent's output and fix bare try statements"""
+    try:
+        # Clean the code string first
+        cleaned_code = c.replace('"""',"'''")
+        # Extract code between python markers, if any
+        match = PYTHON_BLOCK_RE.search(cleaned_code)
+        extracted = match.group(1) if match else cleaned_code
+    except Exception as e:
+        print(f"Warning: Error processing code block: {e}")
+        # Fall back to the original code if processing fails
+        extracted = c
+    # Fix try statement syntax once, whichever branch produced the code
+    return BARE_TRY_RE.sub('try:\n', extracted)
+
+# Canned conclusion returned alongside sample_code.py while synthesis is disabled
+SAMPLE_FINAL_CONCLUSION = """
+            **Conclusion**
+The housing dataset analysis reveals a highly structured market with clear pricing patterns and distinct property segments. The market operates on three primary value drivers: property size (strongest single factor), bundled premium amenities, and location advantages that amplify size benefits. Rather than random pricing, the market shows sophisticated segmentation with three distinct property archetypes serving different buyer demographics.
+
+**Key Takeaways**
+- **Size dominates pricing**: Physical area/square footage is the strongest predictor of property value, serving as the foundation for all other pricing considerations
+- **Premium features cluster strategically**: High-value amenities (air conditioning, basements, guest rooms) tend to appear together, creating distinct market tiers rather than random feature distribution  
+- **Multiplicative location effects**: Preferred areas and main road access don't just add value—they amplify the benefits of larger properties, creating exponential rather than linear premiums
+- **Three distinct market segments**: Compact-Budget (first-time buyers), Standard-Midrange (growing families), and Luxury-Premium (affluent buyers) each with characteristic feature combinations and pricing patterns
+- **Investment opportunities identified**: Statistical modeling revealed over-valued and under-valued properties relative to market patterns, providing systematic investment guidance
+
+**Strategic Implications**
+For buyers, focus on size first, then evaluate bundled amenities for efficiency. For sellers, emphasize feature combinations and location-size synergies. For investors, the outlier analysis provides a data-driven approach to identifying market inefficiencies and undervalued opportunities.
+
+**Recommended Next Steps**
+1. Resolve technical visualization issues to enable interactive market exploration
+2. Incorporate temporal data to identify market timing patterns and seasonal trends
+3. Expand analysis to neighborhood-level factors for more granular location insights
+4. Develop predictive pricing models based on identified statistical relationships"""
+
+@lru_cache(maxsize=8)
+def _read_sample(path: str, mtime: float) -> str:
+    """Read a sample code file once per modification time"""
+    with open(path, "r") as f:
+        return f.read()
 
 class deep_analysis_module(dspy.Module):
     def __init__(self,agents, agents_desc):
@@ -620,11 +665,13 @@ class deep_analysis_module(dspy.Module):
         if session_df is not None:
             globals()['df'] = session_df
         
-        questions = self.deep_questions(goal = goal, dataset_info=dataset_info)
+        # The dspy modules here are synchronous; run them in a worker thread so
+        # other requests' coroutines keep running while the LLM call is in flight
+        questions = await asyncio.to_thread(self.deep_questions, goal=goal, dataset_info=dataset_info)
         # Convert the deep questions into a dictionary with numbered keys
         print("Questions generated")
         question_list = [q.strip() for q in questions.deep_questions.split('\n') if q.strip()]
-        deep_plan = self.deep_planner(deep_questions = questions.deep_questions, dataset=dataset_info, agents_desc=str(self.agents_desc))
+        deep_plan = await asyncio.to_thread(self.deep_planner, deep_questions=questions.deep_questions, dataset=dataset_info, agents_desc=str(self.agents_desc))
         print("Plan created")
         try:
             # First try to safely evaluate the string representation of the dictionary
@@ -642,7 +689,7 @@ class deep_analysis_module(dspy.Module):
 
         except (ValueError, SyntaxError, json.JSONDecodeError) as e:
             try:
-                deep_plan = self.deep_plan_fixer(plan_instructions=deep_plan.plan_instructions)
+                deep_plan = await asyncio.to_thread(self.deep_plan_fixer, plan_instructions=deep_plan.plan_instructions)
                 plan_instructions = ast.literal_eval(deep_plan.fixed_plan)
                 if not isinstance(plan_instructions, dict):
                     # If not a dict, try to parse it as JSON
@@ -674,43 +721,15 @@ class deep_analysis_module(dspy.Module):
         
 
         
-        # Await all tasks to complete
-        summaries = []
-        codes = []
-        plotly_figs = []
-        print_outputs = []
+        # Await all tasks to complete; gather keeps results in plan-key order
         synthesis = []
         print("Tasks started")
-        i = 0
-        for task in asyncio.as_completed(tasks):
-            result = await task
-            summaries.append(result.summary)
-            codes.append(result.code)
-            print("Done with this :"+keys[i])
-            i+=1
+        results = await asyncio.gather(*tasks)
+        print("Done with: " + ", ".join(keys))
+        summaries = [result.summary for result in results]
 
         # Safely extract code from agent outputs
-        # code = ''.join(codes)
-        code = []
-        for c in codes:
-            try:
-                # Clean the code string first
-                cleaned_code = c.replace('"""',"'''")
-                if "```python" in cleaned_code:
-                    # Extract code between python markers
-                    parts = cleaned_code.split("```python")
-                    if len(parts) > 1:
-                        extracted = parts[1].split("```")[0] if "```" in parts[1] else parts[1]
-                        code.append(extracted.replace('try\n','try:\n'))
-                    else:
-                        code.append(cleaned_code.replace('try\n','try:\n'))
-                else:
-                    # No python markers, use the whole code
-                    code.append(cleaned_code.replace('try\n','try:\n'))
-            except Exception as e:
-                print(f"Warning: Error processing code block: {e}")
-                # Fall back to the original code if processing fails
-                code.append(c.replace('try\n','try:\n'))
+        code = [extract_block_code(result.code) for result in results]
         deep_coder = dspy.Refine(module=self.deep_code_synthesizer, N=3, reward_fn=score_code, threshold=1.0, fail_count=2)
         
         # Check if we have valid API key
@@ -720,22 +739,19 @@ class deep_analysis_module(dspy.Module):
         
         try:
             with dspy.context(lm = dspy.LM("anthropic/claude-4-sonnet-20250514", api_key = anthropic_key, max_tokens=17000)):
-                print("Starting code generation...")
-                start_time = datetime.now()
-                print(f"Code generation started at: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-                print(f"Processing {len(code)} code blocks...")
-                print(f"Plan instructions: {str(plan_instructions)[:200]}...")
+                logger.log_message("Starting code generation for %d code blocks...", logging.INFO, len(code))
+                start_time = time.perf_counter()
+                logger.log_message("Plan instructions: %.200s...", logging.DEBUG, plan_instructions)
                 
                 # examples = [dspy.Example(deep_questions=str(questions.deep_questions), dataset_info=dataset_info,planner_instructions=str(plan_instructions), code=str(code)).with_inputs('deep_questions','dataset_info','planner_instructions','code')]
                 # deep_code = deep_coder(deep_questions=str(questions.deep_questions), dataset_info=dataset_info,planner_instructions=str(plan_instructions), code=str(code))
-                print(f"Code generation completed at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+                logger.log_message("Code generation completed in %.1fs", logging.INFO, time.perf_counter() - start_time)
         except Exception as e:
-            print(f"Error during code generation: {str(e)}")
-            print(f"Error type: {type(e).__name__}")
+            logger.log_message("Error during code generation (%s): %s", logging.ERROR, type(e).__name__, e)
             raise e
 
-        with open("sample_code.py", "r") as f:
-            code = f.read()
+        st = os.stat("sample_code.py")
+        code = _read_sample("sample_code.py", st.st_mtime)
         
         # Execute the code with error handling and session DataFrame
         try:
@@ -748,11 +764,13 @@ class deep_analysis_module(dspy.Module):
                 print(f"Warning: Code execution had errors: {output['error']}")
                 # Continue with whatever output we have
             
-            print_outputs.append(output['printed_output'])
-            plotly_figs.append(output['plotly_figs'])
+            print_outputs = [output['printed_output']]
+            plotly_figs = [output['plotly_figs']]
             
         except Exception as e:
             print(f"Error during code execution: {str(e)}")
+            print_outputs = []
+            plotly_figs = []
             # Create fallback output structure
             output = {
                 'exec_result': None,
@@ -790,25 +808,7 @@ class deep_analysis_module(dspy.Module):
             'code':code,
             'plotly_figs':plotly_figs,
             "synthesis": summaries,
-            "final_conclusion": """
-            **Conclusion**
-The housing dataset analysis reveals a highly structured market with clear pricing patterns and distinct property segments. The market operates on three primary value drivers: property size (strongest single factor), bundled premium amenities, and location advantages that amplify size benefits. Rather than random pricing, the market shows sophisticated segmentation with three distinct property archetypes serving different buyer demographics.
-
-**Key Takeaways**
-- **Size dominates pricing**: Physical area/square footage is the strongest predictor of property value, serving as the foundation for all other pricing considerations
-- **Premium features cluster strategically**: High-value amenities (air conditioning, basements, guest rooms) tend to appear together, creating distinct market tiers rather than random feature distribution  
-- **Multiplicative location effects**: Preferred areas and main road access don't just add value—they amplify the benefits of larger properties, creating exponential rather than linear premiums
-- **Three distinct market segments**: Compact-Budget (first-time buyers), Standard-Midrange (growing families), and Luxury-Premium (affluent buyers) each with characteristic feature combinations and pricing patterns
-- **Investment opportunities identified**: Statistical modeling revealed over-valued and under-valued properties relative to market patterns, providing systematic investment guidance
-
-**Strategic Implications**
-For buyers, focus on size first, then evaluate bundled amenities for efficiency. For sellers, emphasize feature combinations and location-size synergies. For investors, the outlier analysis provides a data-driven approach to identifying market inefficiencies and undervalued opportunities.
-
-**Recommended Next Steps**
-1. Resolve technical visualization issues to enable interactive market exploration
-2. Incorporate temporal data to identify market timing patterns and seasonal trends
-3. Expand analysis to neighborhood-level factors for more granular location insights
-4. Develop predictive pricing models based on identified statistical relationships""",
+            "final_conclusion": SAMPLE_FINAL_CONCLUSION,
             # 'synthesis':[s.synthesized_report for s in synthesis ], 
             # 'final_conclusion':final_conclusion.final_conclusion 
         }
@@ -12,6 +12,36 @@ load_dotenv()
 # Create the database engine based on environment variable
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///chat_database.db")
 
+# Serialize JSON columns (plotly figures, summaries) with orjson when available
+try:
+    import orjson
+
+    def _orjson_serializer(obj):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    json_engine_options = {"json_serializer": _orjson_serializer, "json_deserializer": orjson.loads}
+except ImportError:
+    json_engine_options = {}
+
+# Applied to every new SQLite connection: WAL lets readers run alongside the writer and,
+# with synchronous=NORMAL, commits fsync only at checkpoints instead of per transaction.
+# Everything but journal_mode is per-connection, so each engine needs this listener.
+SQLITE_PRAGMAS = (
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",  # 64 MiB page cache
+    "PRAGMA mmap_size=10737418240",
+    "PRAGMA busy_timeout=5000",
+)
+
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
 # Determine database type and set appropriate engine configurations
 if DATABASE_URL.startswith('postgresql'):
     # PostgreSQL-specific configuration
@@ -20,20 +50,18 @@ if DATABASE_URL.startswith('postgresql'):
         pool_size=10,
         max_overflow=20,
         pool_pre_ping=True,  # Check connection validity before use
-        pool_recycle=300     # Recycle connections after 5 minutes
+        pool_recycle=300,    # Recycle connections after 5 minutes
+        pool_use_lifo=True,  # Reuse the most recently returned (warmest) connection
+        pool_timeout=5,      # Fail fast instead of queueing 30s for a connection
+        **json_engine_options
     )
     is_postgresql = True
     logger.log_message("Using PostgreSQL database engine", logging.INFO)
 else:
     # SQLite configuration
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(DATABASE_URL, **json_engine_options)
     is_postgresql = False
-    # For SQLite, enable foreign key constraints
-    @event.listens_for(engine, "connect")
-    def set_sqlite_pragma(dbapi_connection, connection_record):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON")
-        cursor.close()
+    event.listen(engine, "connect", set_sqlite_pragma)
     logger.log_message("Using SQLite database engine", logging.INFO)
 
 # Create session factory
@@ -1,11 +1,40 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Text, Float, Boolean, JSON
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, ForeignKey, DateTime, Text, Float, Boolean, JSON, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
+import base64
+import zlib
 
 # Define the base class for declarative models
 Base = declarative_base()
 
+# JSON everywhere, stored as binary JSONB on PostgreSQL
+JSONType = JSON().with_variant(JSONB(), 'postgresql')
+
+class CompressedText(TypeDecorator):
+    """Text column that stores large values zlib-compressed (base64, with a marker prefix).
+
+    Values without the prefix are returned unchanged, so rows written before
+    compression was introduced keep reading correctly.
+    """
+    impl = Text
+    cache_ok = True
+
+    PREFIX = 'zlib:'
+    MIN_SIZE = 1024  # Smaller values are stored as-is
+
+    def process_bind_param(self, value, dialect):
+        if value is None or len(value) < self.MIN_SIZE:
+            return value
+        return self.PREFIX + base64.b64encode(zlib.compress(value.encode('utf-8'), 6)).decode('ascii')
+
+    def process_result_value(self, value, dialect):
+        if value is None or not value.startswith(self.PREFIX):
+            return value
+        return zlib.decompress(base64.b64decode(value[len(self.PREFIX):])).decode('utf-8')
+
 # Define the Users table
 class User(Base):
     __tablename__ = 'users'
@@ -24,23 +53,25 @@ class Chat(Base):
     __tablename__ = 'chats'
     
     chat_id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey('users.user_id', ondelete="CASCADE"), nullable=True)
+    user_id = Column(Integer, ForeignKey('users.user_id', ondelete="CASCADE"), nullable=True, index=True)
     title = Column(String, default='New Chat')
     created_at = Column(DateTime, default=datetime.utcnow)
     # Add relationships for cascade options
     user = relationship("User", back_populates="chats")
-    messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan")
+    messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan", order_by="Message.timestamp")
     usage_records = relationship("ModelUsage", back_populates="chat")
 
 # Define the Messages table
 class Message(Base):
     __tablename__ = 'messages'
+    # Messages are always read per chat in timestamp order; also serves chat_id-only lookups
+    __table_args__ = (Index('ix_messages_chat_ts', 'chat_id', 'timestamp'),)
     
     message_id = Column(Integer, primary_key=True, autoincrement=True)
     chat_id = Column(Integer, ForeignKey('chats.chat_id', ondelete="CASCADE"), nullable=False)
     sender = Column(String, nullable=False)  # 'user' or 'ai'
     content = Column(Text, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     # Add relationship for cascade options
     chat = relationship("Chat", back_populates="messages")
     feedback = relationship("MessageFeedback", back_populates="message", uselist=False, cascade="all, delete-orphan")
@@ -49,21 +80,23 @@ class Message(Base):
 class ModelUsage(Base):
     """Tracks AI model usage metrics for analytics and billing purposes."""
     __tablename__ = 'model_usage'
+    # Analytics filter per user over a time range
+    __table_args__ = (Index('ix_usage_user_time', 'user_id', 'timestamp'),)
     
     usage_id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.user_id', ondelete="SET NULL"), nullable=True)
-    chat_id = Column(Integer, ForeignKey('chats.chat_id', ondelete="SET NULL"), nullable=True)
+    user_id = Column(Integer, ForeignKey('users.user_id', ondelete="SET NULL"), nullable=True)  # Leading column of ix_usage_user_time
+    chat_id = Column(Integer, ForeignKey('chats.chat_id', ondelete="SET NULL"), nullable=True, index=True)
     model_name = Column(String(100), nullable=False)
     provider = Column(String(50), nullable=False)
-    prompt_tokens = Column(Integer, default=0)
-    completion_tokens = Column(Integer, default=0)
-    total_tokens = Column(Integer, default=0)
+    prompt_tokens = Column(BigInteger, default=0)
+    completion_tokens = Column(BigInteger, default=0)
+    total_tokens = Column(BigInteger, default=0)
     query_size = Column(Integer, default=0)  # Size in characters
     response_size = Column(Integer, default=0)  # Size in characters
     cost = Column(Float, default=0.0)  # Cost in USD
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     is_streaming = Column(Boolean, default=False)
-    request_time_ms = Column(Integer, default=0)  # Request processing time in milliseconds
+    request_time_ms = Column(BigInteger, default=0)  # Request processing time in milliseconds
     # Add relationships
     user = relationship("User", back_populates="usage_records")
     chat = relationship("Chat", back_populates="usage_records")
@@ -74,9 +107,9 @@ class CodeExecution(Base):
     __tablename__ = 'code_executions'
     
     execution_id = Column(Integer, primary_key=True, autoincrement=True)
-    message_id = Column(Integer, ForeignKey('messages.message_id', ondelete="CASCADE"), nullable=True)
-    chat_id = Column(Integer, ForeignKey('chats.chat_id', ondelete="CASCADE"), nullable=True)
-    user_id = Column(Integer, ForeignKey('users.user_id', ondelete="SET NULL"), nullable=True)
+    message_id = Column(Integer, ForeignKey('messages.message_id', ondelete="CASCADE"), nullable=True, index=True)
+    chat_id = Column(Integer, ForeignKey('chats.chat_id', ondelete="CASCADE"), nullable=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.user_id', ondelete="SET NULL"), nullable=True, index=True)
     
     # Code tracking
     initial_code = Column(Text, nullable=True)  # First version of code submitted
@@ -97,7 +130,7 @@ class CodeExecution(Base):
     error_messages = Column(Text, nullable=True)  # JSON map of error messages by agent
     
     # Metadata
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
 class MessageFeedback(Base):
@@ -105,7 +138,7 @@ class MessageFeedback(Base):
     __tablename__ = 'message_feedback'
     
     feedback_id = Column(Integer, primary_key=True, autoincrement=True)
-    message_id = Column(Integer, ForeignKey('messages.message_id', ondelete="CASCADE"), nullable=False)
+    message_id = Column(Integer, ForeignKey('messages.message_id', ondelete="CASCADE"), nullable=False, index=True)
     
     # User feedback
     rating = Column(Integer, nullable=True)  # Star rating (1-5)
@@ -129,7 +162,7 @@ class DeepAnalysisReport(Base):
     
     report_id = Column(Integer, primary_key=True, autoincrement=True)
     report_uuid = Column(String(100), unique=True, nullable=False)  # Frontend generated ID
-    user_id = Column(Integer, ForeignKey('users.user_id', ondelete="CASCADE"), nullable=True)
+    user_id = Column(Integer, ForeignKey('users.user_id', ondelete="CASCADE"), nullable=True, index=True)
     
     # Analysis objective and status
     goal = Column(Text, nullable=False)  # The analysis objective/question
@@ -143,30 +176,30 @@ class DeepAnalysisReport(Base):
     # Analysis components (stored as text/JSON)
     deep_questions = Column(Text, nullable=True)  # Generated analytical questions
     deep_plan = Column(Text, nullable=True)  # Analysis plan
-    summaries = Column(JSON, nullable=True)  # Array of analysis summaries
-    analysis_code = Column(Text, nullable=True)  # Generated Python code
-    plotly_figures = Column(JSON, nullable=True)  # Array of Plotly figure data
-    synthesis = Column(JSON, nullable=True)  # Array of synthesis insights
+    summaries = Column(JSONType, nullable=True)  # Array of analysis summaries
+    analysis_code = Column(CompressedText, nullable=True)  # Generated Python code
+    plotly_figures = Column(JSONType, nullable=True)  # Array of Plotly figure data
+    synthesis = Column(JSONType, nullable=True)  # Array of synthesis insights
     final_conclusion = Column(Text, nullable=True)  # Final analysis conclusion
     
     # Report output
-    html_report = Column(Text, nullable=True)  # Complete HTML report
+    html_report = Column(CompressedText, nullable=True)  # Complete HTML report
     report_summary = Column(Text, nullable=True)  # Brief summary for listing
     
     # Execution tracking
     progress_percentage = Column(Integer, default=0)  # Progress 0-100
-    steps_completed = Column(JSON, nullable=True)  # Array of completed step names
+    steps_completed = Column(JSONType, nullable=True)  # Array of completed step names
     error_message = Column(Text, nullable=True)  # Error details if failed
     
     # Model and cost tracking
     model_provider = Column(String(50), nullable=True)
     model_name = Column(String(100), nullable=True)
-    total_tokens_used = Column(Integer, default=0)
+    total_tokens_used = Column(BigInteger, default=0)
     estimated_cost = Column(Float, default=0.0)  # Cost in USD
     credits_consumed = Column(Integer, default=0)  # Credits deducted for this analysis
     
     # Metadata
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
@@ -2,66 +2,185 @@ import logging
 from typing import Optional, Dict, Any
 import time
 from src.db.schemas.models import ModelUsage
-from src.db.init_db import session_factory
+from src.db.init_db import engine
 from datetime import datetime, UTC
-import tiktoken
+from functools import lru_cache
 from src.routes.analytics_routes import handle_new_model_usage
 import asyncio
 
 from src.utils.logger import Logger
 from src.utils.model_registry import get_provider_for_model, calculate_cost
 
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
 logger = Logger(name="ai_manager", see_time=True, console_log=True)
 
+# Usage rows are written in batches of up to this many, at most this long after the first is queued
+USAGE_FLUSH_MAX_ROWS = 100
+USAGE_FLUSH_INTERVAL_S = 1.0
+# Stored rows waiting to be broadcast to analytics clients; newer events are dropped beyond this
+USAGE_BROADCAST_QUEUE_SIZE = 1000
+# Plain Core statement on the table; no ORM entity or mapper involved in the insert
+USAGE_INSERT = ModelUsage.__table__.insert()
+# Queued after the last row on shutdown; the writer flushes its batch and exits when it sees it
+_STOP = object()
+
+class UsageCollector:
+    """Buffers ModelUsage rows and writes each batch with a single Core INSERT"""
+
+    def __init__(self, max_rows=USAGE_FLUSH_MAX_ROWS, flush_interval=USAGE_FLUSH_INTERVAL_S):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self._loop = None
+        self._queue = None
+        self._writer = None
+        self._broadcasts = None
+        self._broadcaster = None
+        self._closed = False
+
+    def enqueue(self, record: Dict[str, Any]):
+        """Queue a usage row; safe to call from the event loop or from worker threads"""
+        if self._closed:
+            # Shutting down: the writer is gone, so store the row directly
+            self._write([record])
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if self._loop is not None and self._loop.is_running():
+                # Worker thread (e.g. run_in_executor): re-enqueue on the writer's loop,
+                # which also restarts the writer if it has stopped
+                self._loop.call_soon_threadsafe(self.enqueue, record)
+            else:
+                self._write([record])
+            return
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._broadcasts = asyncio.Queue(maxsize=USAGE_BROADCAST_QUEUE_SIZE)
+            self._writer = None
+            self._broadcaster = loop.create_task(self._broadcast())
+        if self._writer is None or self._writer.done():
+            if self._writer is not None:
+                # Keep the existing queue so rows waiting for the dead writer are still stored
+                logger.log_message("Usage writer stopped unexpectedly, restarting it", level=logging.WARNING)
+            self._writer = loop.create_task(self._run())
+        self._queue.put_nowait(record)
+
+    async def aclose(self):
+        """Write every queued row and wait for the batch in flight; called on app shutdown"""
+        self._closed = True
+        if self._writer is None:
+            return
+        if not self._writer.done():
+            self._queue.put_nowait(_STOP)
+            try:
+                await self._writer
+            except Exception as e:
+                logger.log_message(f"Usage writer failed during shutdown: {str(e)}", level=logging.ERROR)
+        # Rows left behind by a writer that stopped early
+        rows = []
+        while not self._queue.empty():
+            row = self._queue.get_nowait()
+            if row is not _STOP:
+                rows.append(row)
+        if rows:
+            await asyncio.to_thread(self._write, rows)
+        self._broadcaster.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await self._queue.get()
+            if row is _STOP:
+                return
+            rows = [row]
+            deadline = loop.time() + self.flush_interval
+            while len(rows) < self.max_rows:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                rows.append(row)
+            if await asyncio.to_thread(self._write, rows):
+                # Broadcast only rows that were actually stored; a slow client must not hold up writes
+                for row in rows:
+                    try:
+                        self._broadcasts.put_nowait(row)
+                    except asyncio.QueueFull:
+                        logger.log_message("Usage broadcast queue full, dropping event", level=logging.WARNING)
+
+    async def _broadcast(self):
+        while True:
+            row = await self._broadcasts.get()
+            try:
+                await handle_new_model_usage(row)
+            except Exception as e:
+                logger.log_message(f"Error broadcasting usage event: {str(e)}", level=logging.ERROR)
+
+    def _write(self, rows):
+        # Rows are stamped when the call happened; unstamped rows get a copy with the write time
+        now = datetime.now(UTC)
+        rows = [row if "timestamp" in row else {**row, "timestamp": now} for row in rows]
+        try:
+            with engine.begin() as conn:
+                conn.execute(USAGE_INSERT, rows)
+            return True
+        except Exception as e:
+            logger.log_message(f"Error saving {len(rows)} usage records to database: {str(e)}", level=logging.ERROR)
+            return False
+
+usage_collector = UsageCollector()
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    """Process-wide tokenizer: the cl100k_base encoding is parsed once, not per AI_Manager"""
+    if tiktoken is None:
+        logger.log_message("Tiktoken not available, using simple tokenizer", level=logging.WARNING)
+        return SimpleTokenizer()
+    return tiktoken.get_encoding("cl100k_base")
+
 class AI_Manager:
     """Manages AI model interactions and usage tracking"""
     
     def __init__(self):
-        self.tokenizer = None
-        # Initialize tokenizer - could use tiktoken or another tokenizer
-        try:
-            import tiktoken
-            self.tokenizer = tiktoken.get_encoding("cl100k_base")
-        except ImportError:
-            logger.log_message("Tiktoken not available, using simple tokenizer", level=logging.WARNING)
-            self.tokenizer = SimpleTokenizer()
+        self.tokenizer = get_tokenizer()
             
     def save_usage_to_db(self, user_id, chat_id, model_name, provider, 
                        prompt_tokens, completion_tokens, total_tokens,
                        query_size, response_size, cost, request_time_ms, 
                        is_streaming=False):
-        """Save model usage data to the database"""
+        """Queue model usage data for a batched database write"""
+        record = {
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "model_name": model_name,
+            "provider": provider,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": total_tokens,
+            "query_size": query_size,
+            "response_size": response_size,
+            "cost": cost,
+            "is_streaming": is_streaming,
+            "request_time_ms": request_time_ms,
+            "timestamp": datetime.now(UTC)
+        }
         try:
-            session = session_factory()
-            
-            usage = ModelUsage(
-                user_id=user_id,
-                chat_id=chat_id,
-                model_name=model_name,
-                provider=provider,
-                prompt_tokens=prompt_tokens,
-                completion_tokens=completion_tokens,
-                total_tokens=total_tokens,
-                query_size=query_size,
-                response_size=response_size,
-                cost=cost,
-                timestamp=datetime.now(UTC),
-                is_streaming=is_streaming,
-                request_time_ms=request_time_ms
-            )
-            
-            session.add(usage)
-            session.commit()
-            # logger.info(f"Saved usage data to database for chat {chat_id}: {total_tokens} tokens, ${cost:.6f}")
-            
-            # Broadcast the event asynchronously
-            asyncio.create_task(handle_new_model_usage(usage))
-            
+            # Stored and broadcast by the collector's background writer
+            usage_collector.enqueue(record)
         except Exception as e:
-            session.rollback()
             logger.log_message(f"Error saving usage data to database for chat {chat_id}: {str(e)}", level=logging.ERROR)
-        finally:
-            session.close()
         
     def calculate_cost(self, model_name, input_tokens, output_tokens):
         """Calculate the cost for using the model based on tokens"""
@@ -70,7 +189,7 @@ class AI_Manager:
         
         # Get provider for logging
         model_provider = get_provider_for_model(model_name)    
-        logger.log_message(f"[> ] Model Name: {model_name}, Model Provider: {model_provider}", level=logging.INFO)
+        logger.log_message("[> ] Model Name: %s, Model Provider: %s", logging.INFO, model_name, model_provider)
         
         # Use the centralized calculate_cost function
         return calculate_cost(model_name, input_tokens, output_tokens)
@@ -83,4 +202,5 @@ class AI_Manager:
 class SimpleTokenizer:
     """A very simple tokenizer implementation for fallback"""
     def encode(self, text):
-        return len(text.split())
+        # ~4 characters per token; a range supports len() like tiktoken's token list without allocating one
+        return range((len(text) + 3) // 4)
@@ -1,6 +1,9 @@
+import copy
 import json
 import logging
 import os
+import threading
+import time
 from collections import defaultdict
 from datetime import datetime, timedelta, UTC
 
@@ -9,10 +12,10 @@ from fastapi.security import APIKeyHeader
 
 from pydantic import BaseModel
 
-from sqlalchemy import case, desc, func
+from sqlalchemy import case, desc, func, lambda_stmt, select
 from sqlalchemy.orm import Session
 
-from src.db.init_db import get_db, get_session
+from src.db.init_db import get_db
 from src.db.schemas.models import ModelUsage, CodeExecution, Message, MessageFeedback
 from src.managers.chat_manager import ChatManager
 
@@ -84,6 +87,26 @@ def get_date_range(period: str):
     
     return start_date, today
 
+# Dashboard results per period. Every period ends "now", so results are reused for a short
+# window instead of being keyed on exact datetimes (which would never repeat)
+DASHBOARD_PERIODS = ('7d', '30d', '90d')
+DASHBOARD_CACHE_TTL_S = 60
+_dashboard_cache = {}
+_dashboard_cache_lock = threading.Lock()
+
+def get_cached_dashboard(period: str):
+    """Return a copy of the cached dashboard result for period, or None if missing or stale"""
+    with _dashboard_cache_lock:
+        entry = _dashboard_cache.get(period)
+    if entry is None or entry[0] <= time.monotonic():
+        return None
+    return copy.deepcopy(entry[1])
+
+def cache_dashboard(period: str, result: Dict[str, Any]):
+    """Store a private copy of a dashboard result for period"""
+    with _dashboard_cache_lock:
+        _dashboard_cache[period] = (time.monotonic() + DASHBOARD_CACHE_TTL_S, copy.deepcopy(result))
+
 # Dashboard endpoint - combines summary data for the main dashboard
 @router.get("/dashboard")
 async def get_dashboard_data(
@@ -92,6 +115,11 @@ async def get_dashboard_data(
     api_key: str = Depends(verify_admin_api_key)
 ):
     logger.log_message(f"Dashboard data requested for period: {period}", logging.INFO)
+    # Unknown periods fall back to 30 days in get_date_range, so they share its cache entry
+    cache_key = period if period in DASHBOARD_PERIODS else '30d'
+    cached = get_cached_dashboard(cache_key)
+    if cached is not None:
+        return cached
     start_date, end_date = get_date_range(period)
     
     # Get total stats
@@ -190,6 +218,7 @@ async def get_dashboard_data(
         "end_date": end_date.strftime('%Y-%m-%d'),
     }
     logger.log_message(f"Dashboard data retrieved: {len(daily_usage)} days, {len(model_usage)} models, {len(top_users)} top users", logging.INFO)
+    cache_dashboard(cache_key, result)
     return result
 
 # WebSocket endpoint for real-time dashboard updates
@@ -787,52 +816,46 @@ async def get_usage_summary(
     return await get_dashboard_data(period="30d", db=db, api_key=api_key)
 
 # Event handler for new ModelUsage entries
-async def handle_new_model_usage(model_usage: ModelUsage):
+async def handle_new_model_usage(model_usage: Dict[str, Any]):
     """
     Process a new model usage event and broadcast updates to connected clients.
-    This function should be called whenever a new model usage record is created.
+    This function should be called whenever a new model usage record is stored,
+    with that row's column values (a plain dict, so no database session is needed).
     """
-    # Ensure the model_usage instance is refreshed and bound to a session
-    session = get_session()  # Assuming get_session() is a function that provides a new session
     try:
-        # Refresh the instance to ensure it's bound to the session
-        session.refresh(model_usage)
-
-        model_usage = session.merge(model_usage)  # Reattach to session
-        session.refresh(model_usage)  # Refresh attributes
-        logger.log_message(f"Processing new model usage event: {model_usage.model_name}, user: {model_usage.user_id}", level=logging.INFO)
+        logger.log_message(f"Processing new model usage event: {model_usage['model_name']}, user: {model_usage.get('user_id')}", level=logging.INFO)
         
-        
-        date_str = model_usage.timestamp.strftime('%Y-%m-%d') if model_usage.timestamp else None
+        timestamp = model_usage.get("timestamp")
+        date_str = timestamp.strftime('%Y-%m-%d') if timestamp else None
         
         # Create dashboard update
         dashboard_update = {
             "type": "usage_update",
             "date": date_str,
             "metrics": {
-                "tokens_delta": model_usage.total_tokens,
-                "cost_delta": model_usage.cost,
+                "tokens_delta": model_usage.get("total_tokens"),
+                "cost_delta": model_usage.get("cost"),
                 "requests_delta": 1
             }
         }
         # Create model update
         model_update = {
             "type": "model_update",
-            "model_name": model_usage.model_name,
+            "model_name": model_usage["model_name"],
             "metrics": {
-                "tokens": model_usage.total_tokens,
-                "cost": model_usage.cost,
+                "tokens": model_usage.get("total_tokens"),
+                "cost": model_usage.get("cost"),
                 "requests": 1
             }
         }
         
-        if model_usage.user_id:
+        if model_usage.get("user_id"):
             user_update = {
                 "type": "user_activity",
                 "date": date_str,
                 "metrics": {
                     "activeUsers": 1,  # This will be merged with existing data
-                    "sessions": 1 if model_usage.chat_id else 0
+                    "sessions": 1 if model_usage.get("chat_id") else 0
                 }
             }
             await broadcast_user_update(user_update)
@@ -843,8 +866,6 @@ async def handle_new_model_usage(model_usage: ModelUsage):
         logger.log_message("Model usage updates broadcasted successfully", logging.INFO)
     except Exception as e:
         logger.log_message(f"Error processing model usage event: {str(e)}", logging.ERROR)
-    finally:
-        session.close()  # Ensure the session is closed after use
 
 @router.get("/tiers/usage")
 async def get_tier_usage(
@@ -1115,22 +1136,25 @@ async def get_code_execution_summary(
     
     # Get failed agent statistics
     failed_agent_data = []
-    failed_executions = db.query(CodeExecution).filter(
-        CodeExecution.created_at.between(start_date, end_date),
-        CodeExecution.is_successful == False,
-        CodeExecution.failed_agents.isnot(None)
-    ).all()
+    # Only the failed_agents column is read, as plain values rather than CodeExecution objects
+    failed_agents_values = db.execute(
+        select(CodeExecution.failed_agents).where(
+            CodeExecution.created_at.between(start_date, end_date),
+            CodeExecution.is_successful == False,
+            CodeExecution.failed_agents.isnot(None)
+        )
+    ).scalars()
     
     # Count agent failures
     agent_failure_counts = {}
-    for execution in failed_executions:
+    for failed_agents_json in failed_agents_values:
         try:
-            if execution.failed_agents:
-                failed_agents = json.loads(execution.failed_agents)
+            if failed_agents_json:
+                failed_agents = json.loads(failed_agents_json)
                 for agent in failed_agents:
                     agent_failure_counts[agent] = agent_failure_counts.get(agent, 0) + 1
         except (json.JSONDecodeError, TypeError):
-            logger.log_message(f"Error parsing failed_agents JSON: {execution.failed_agents}", logging.ERROR)
+            logger.log_message(f"Error parsing failed_agents JSON: {failed_agents_json}", logging.ERROR)
     
     # Convert to list for response
     failed_agent_data = [
@@ -1175,26 +1199,43 @@ async def get_detailed_code_executions(
     logger.log_message(f"Detailed code executions requested for period: {period}", logging.INFO)
     start_date, end_date = get_date_range(period)
     
-    # Build the query with filters
-    query = db.query(CodeExecution).filter(
+    # Build the query with filters; plain rows of the reported columns (the full output text is never sent).
+    # As a lambda_stmt each variant is built and cache-keyed once, later calls only bind new values
+    query = lambda_stmt(lambda: select(
+        CodeExecution.execution_id,
+        CodeExecution.message_id,
+        CodeExecution.chat_id,
+        CodeExecution.user_id,
+        CodeExecution.created_at,
+        CodeExecution.updated_at,
+        CodeExecution.is_successful,
+        CodeExecution.model_provider,
+        CodeExecution.model_name,
+        CodeExecution.model_temperature,
+        CodeExecution.model_max_tokens,
+        CodeExecution.failed_agents,
+        CodeExecution.error_messages,
+        CodeExecution.initial_code,
+        CodeExecution.latest_code
+    ).where(
         CodeExecution.created_at.between(start_date, end_date)
-    )
+    ))
     
     # Apply optional filters
     if success_filter is not None:
-        query = query.filter(CodeExecution.is_successful == success_filter)
+        query += lambda q: q.where(CodeExecution.is_successful == success_filter)
     
     if user_id:
-        query = query.filter(CodeExecution.user_id == user_id)
+        query += lambda q: q.where(CodeExecution.user_id == user_id)
     
     if model_name:
-        query = query.filter(CodeExecution.model_name == model_name)
+        query += lambda q: q.where(CodeExecution.model_name == model_name)
     
     # Order by most recent first and limit results
-    query = query.order_by(desc(CodeExecution.created_at)).limit(limit)
+    query += lambda q: q.order_by(desc(CodeExecution.created_at)).limit(limit)
     
     # Execute query
-    executions = query.all()
+    executions = db.execute(query).all()
     
     # Process results
     detailed_executions = []
@@ -1307,20 +1348,23 @@ async def get_error_analysis(
     start_date, end_date = get_date_range(period)
     
     # Get failed executions
-    failed_executions = db.query(CodeExecution).filter(
-        CodeExecution.created_at.between(start_date, end_date),
-        CodeExecution.is_successful == False,
-        CodeExecution.error_messages.isnot(None)
-    ).all()
+    # Only the error_messages column is read, as plain values rather than CodeExecution objects
+    failed_executions = db.execute(
+        select(CodeExecution.error_messages).where(
+            CodeExecution.created_at.between(start_date, end_date),
+            CodeExecution.is_successful == False,
+            CodeExecution.error_messages.isnot(None)
+        )
+    ).scalars().all()
     
     # Analyze error messages and categorize them
     error_types = {}
     error_by_agent = {}
     
-    for execution in failed_executions:
+    for error_messages_json in failed_executions:
         try:
-            if execution.error_messages:
-                error_messages = json.loads(execution.error_messages)
+            if error_messages_json:
+                error_messages = json.loads(error_messages_json)
                 for agent, error in error_messages.items():
                     # Add to agent-specific counts
                     if agent not in error_by_agent:
@@ -1337,7 +1381,7 @@ async def get_error_analysis(
                     # Add to overall error type counts
                     error_types[error_category] = error_types.get(error_category, 0) + 1
         except (json.JSONDecodeError, TypeError):
-            logger.log_message(f"Error parsing error_messages JSON: {execution.error_messages}", logging.ERROR)
+            logger.log_message(f"Error parsing error_messages JSON: {error_messages_json}", logging.ERROR)
     
     # Convert to lists for response
     error_types_list = [
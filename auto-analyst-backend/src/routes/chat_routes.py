@@ -1,6 +1,7 @@
 from datetime import datetime
 import logging
 from fastapi import APIRouter, Depends, HTTPException, Query, Body
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from src.db.init_db import session_factory
@@ -18,8 +19,8 @@ load_dotenv()
 # Initialize logger with console logging disabled
 logger = Logger("chat_routes", see_time=True, console_log=False)
 
-# Initialize router
-router = APIRouter(prefix="/chats", tags=["chats"])
+# Initialize router; chat lists and histories are rendered with orjson rather than json.dumps
+router = APIRouter(prefix="/chats", tags=["chats"], default_response_class=ORJSONResponse)
 
 # Initialize chat manager
 chat_manager = ChatManager(db_url=os.getenv("DATABASE_URL"))
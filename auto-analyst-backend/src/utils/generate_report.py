@@ -1,165 +1,32 @@
-from bs4 import BeautifulSoup
+from functools import lru_cache
+from html import escape
 import markdown
 import numpy as np
 import re
 import pandas as pd
+import plotly.io as pio
+from plotly.offline import get_plotlyjs_version
 
 
-def generate_html_report(return_dict):
-    """Generate a clean HTML report focusing on visualizations and key insights"""
-    
-    def convert_markdown_to_html(text):
-        """Convert markdown text to HTML safely"""
-        if not text:
-            return ""
-        # Don't escape HTML characters before markdown conversion
-        html = markdown.markdown(str(text), extensions=['tables', 'fenced_code', 'nl2br'])
-        # Use BeautifulSoup to clean up but preserve structure
-        soup = BeautifulSoup(html, 'html.parser')
-        return str(soup)
-
-    def convert_conclusion_to_html(text):
-        """Special conversion for conclusion with custom bullet point handling"""
-        if not text:
-            return ""
-        
-        # Clean and prepare text
-        text = str(text).strip()
-        
-        text = re.sub(r'\*\*(.*?)\*\*', r'<strong>\1</strong>', text)
-        text = re.sub(r'\*(.*?)\*', r'<em>\1</em>', text)
-        
-        # Handle bullet points that might not be properly formatted
-        lines = text.split('\n')
-        processed_lines = []
-        in_list = False
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                if in_list:
-                    processed_lines.append('</ul>')
-                    in_list = False
-                processed_lines.append('')
-                continue
-                
-            # Check if line looks like a bullet point
-            if (line.startswith('- ') or line.startswith('• ') or 
-                line.startswith('* ') or re.match(r'^\d+\.\s', line)):
-                
-                if not in_list:
-                    processed_lines.append('<ul>')
-                    in_list = True
-                
-                # Clean the bullet point
-                clean_line = re.sub(r'^[-•*]\s*', '', line)
-                clean_line = re.sub(r'^\d+\.\s*', '', clean_line)
-                processed_lines.append(f'<li>{clean_line}</li>')
-            else:
-                if in_list:
-                    processed_lines.append('</ul>')
-                    in_list = False
-                processed_lines.append(f'<p>{line}</p>')
-        
-        if in_list:
-            processed_lines.append('</ul>')
-        
-        # Join and clean up
-        html_content = '\n'.join(processed_lines)
-        
-        # Clean up extra tags and escape HTML entities, but preserve our intentional HTML
-        html_content = html_content.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
-        
-        # Restore our intentional HTML tags
-        html_content = html_content.replace('&lt;strong&gt;', '<strong>').replace('&lt;/strong&gt;', '</strong>')
-        html_content = html_content.replace('&lt;em&gt;', '<em>').replace('&lt;/em&gt;', '</em>')
-        html_content = html_content.replace('&lt;ul&gt;', '<ul>').replace('&lt;/ul&gt;', '</ul>')
-        html_content = html_content.replace('&lt;li&gt;', '<li>').replace('&lt;/li&gt;', '</li>')
-        html_content = html_content.replace('&lt;p&gt;', '<p>').replace('&lt;/p&gt;', '</p>')
-        
-        return html_content
-
-    # Convert key text sections to HTML
-    goal = convert_markdown_to_html(return_dict['goal'])
-    questions = convert_markdown_to_html(return_dict['deep_questions'])
-    conclusion = convert_conclusion_to_html(return_dict['final_conclusion'])
-    # Remove duplicate conclusion headings and clean up
-    conclusion = re.sub(r'<p>\s*\*\*\s*Conclusion\s*\*\*\s*</p>', '', conclusion, flags=re.IGNORECASE)
-    conclusion = re.sub(r'<strong>\s*Conclusion\s*</strong>', '', conclusion, flags=re.IGNORECASE)
-    conclusion = re.sub(r'<h[1-6][^>]*>\s*Conclusion\s*</h[1-6]>', '', conclusion, flags=re.IGNORECASE)
-    conclusion = re.sub(r'^\s*Conclusion\s*$', '', conclusion, flags=re.MULTILINE)
-    
-    # Combine synthesis content
-    synthesis_content = ''
-    if return_dict.get('synthesis'):
-        synthesis_content = ''.join(f'<div class="synthesis-section">{convert_markdown_to_html(s)}</div>' 
-                       for s in return_dict['synthesis'])
+BOLD_RE = re.compile(r'\*\*(.*?)\*\*')
+ITALIC_RE = re.compile(r'\*(.*?)\*')
+# Bullet ("- ", "• ", "* ") or numbered ("1. ") list item; group 1 is the item text
+LIST_ITEM_RE = re.compile(r'^(?:[-•*]\s+|\d+\.\s+)(.*)$')
 
-    # Generate all visualizations for synthesis section
-    all_visualizations = []
-    if return_dict['plotly_figs']:
-        for fig_group in return_dict['plotly_figs']:
-            try:
-                if isinstance(fig_group, list):
-                    # Handle list of figures
-                    for fig in fig_group:
-                        if hasattr(fig, 'to_html'):
-                            # It's a Plotly Figure object
-                            all_visualizations.append(fig.to_html(
-                                full_html=False, 
-                                include_plotlyjs='cdn', 
-                                config={'displayModeBar': True}
-                            ))
-                        elif isinstance(fig, str):
-                            # It might be JSON format - try to convert
-                            try:
-                                import plotly.io
-                                fig_obj = plotly.io.from_json(fig)
-                                all_visualizations.append(fig_obj.to_html(
-                                    full_html=False, 
-                                    include_plotlyjs='cdn', 
-                                    config={'displayModeBar': True}
-                                ))
-                            except Exception as e:
-                                print(f"Warning: Could not process figure JSON: {e}")
-                                continue
-                else:
-                    # Single figure
-                    if hasattr(fig_group, 'to_html'):
-                        # It's a Plotly Figure object
-                        all_visualizations.append(fig_group.to_html(
-                            full_html=False, 
-                            include_plotlyjs='cdn', 
-                            config={'displayModeBar': True}
-                        ))
-                    elif isinstance(fig_group, str):
-                        # It might be JSON format - try to convert
-                        try:
-                            import plotly.io
-                            fig_obj = plotly.io.from_json(fig_group)
-                            all_visualizations.append(fig_obj.to_html(
-                                full_html=False, 
-                                include_plotlyjs='cdn', 
-                                config={'displayModeBar': True}
-                            ))
-                        except Exception as e:
-                            print(f"Warning: Could not process figure JSON: {e}")
-                            continue
-                            
-            except Exception as e:
-                print(f"Warning: Error processing visualizations: {e}")
+# Figures are rendered without their own plotly.js, so the page loads it once
+PLOTLYJS_CDN_URL = f"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"
+PLOTLY_CONFIG = {'displayModeBar': True}
 
-    # Prepare code for syntax highlighting
-    code_content = return_dict.get('code', '').strip()
 
-    html = f"""
+# Static document head (styles and scripts), built once at import
+REPORT_HEAD = f"""
     <!DOCTYPE html>
     <html>
     <head>
         <title>Deep Analysis Report</title>
         <meta charset="utf-8">
         <meta name="viewport" content="width=device-width, initial-scale=1">
-        <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+        <script src="{PLOTLYJS_CDN_URL}"></script>
         <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/styles/github.min.css">
         <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/highlight.min.js"></script>
         <script src="https://cdnjs.cloudflare.com/ajax/libs/highlight.js/11.9.0/languages/python.min.js"></script>
@@ -759,7 +626,12 @@ def generate_html_report(return_dict):
                 document.body.removeChild(textArea);
             }}
         </script>
-    </head>
+    </head>"""
+
+# Strip indentation from the head; newlines are kept so JS line comments stay safe
+REPORT_HEAD = re.sub(r'\n[ \t]+', '\n', REPORT_HEAD)
+
+REPORT_QUESTIONS_SECTION = """
     <body>
         <div class="container">
         <div class="section">
@@ -774,7 +646,9 @@ def generate_html_report(return_dict):
                     {questions}
                 </div>
         </div>
+"""
 
+REPORT_SYNTHESIS_SECTION = """
 
         <div class="section">
                 <h2>Analysis & Insights</h2>
@@ -782,10 +656,9 @@ def generate_html_report(return_dict):
                     {synthesis_content}
         </div>
 
-                {''.join(f'<div class="visualization-container">{viz}</div>' for viz in all_visualizations) if all_visualizations else '<p><em>No visualizations generated</em></p>'}
-            </div>
+                """
 
-            {f'''
+REPORT_CODE_SECTION = """
         <div class="section">
                 <h2>Generated Code</h2>
                 <div class="code-section">
@@ -802,7 +675,9 @@ def generate_html_report(return_dict):
                     </div>
                 </div>
             </div>
-            ''' if code_content else ''}
+            """
+
+REPORT_CONCLUSION_SECTION = """
 
         <div class="section">
                 <h2>Conclusion</h2>
@@ -816,5 +691,133 @@ def generate_html_report(return_dict):
         <div class="page-footer"></div>
     </body>
     </html>"""
-    return html
 
+
+@lru_cache(maxsize=512)
+def _render_markdown(text):
+    """Render markdown to HTML; memoized since report sections often repeat"""
+    # Don't escape HTML characters before markdown conversion; the output is
+    # already well-formed HTML, so it is used as-is without re-parsing
+    return markdown.markdown(text, extensions=['tables', 'fenced_code', 'nl2br'])
+
+
+def convert_markdown_to_html(text):
+    """Convert markdown text to HTML safely"""
+    if not text:
+        return ""
+    return _render_markdown(str(text))
+
+
+def _format_inline(text):
+    """Escape a line of user text, then apply bold/italic markup to it"""
+    text = escape(text, quote=False)
+    text = BOLD_RE.sub(r'<strong>\1</strong>', text)
+    return ITALIC_RE.sub(r'<em>\1</em>', text)
+
+
+def convert_conclusion_to_html(text):
+    """Special conversion for conclusion with custom bullet point handling"""
+    if not text:
+        return ""
+    
+    # Clean and prepare text
+    text = str(text).strip()
+    
+    # Handle bullet points that might not be properly formatted
+    lines = text.split('\n')
+    processed_lines = []
+    in_list = False
+    
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if in_list:
+                processed_lines.append('</ul>')
+                in_list = False
+            processed_lines.append('')
+            continue
+            
+        # Check if line looks like a bullet point
+        list_item = LIST_ITEM_RE.match(line)
+        if list_item:
+            if not in_list:
+                processed_lines.append('<ul>')
+                in_list = True
+            
+            processed_lines.append(f'<li>{_format_inline(list_item.group(1))}</li>')
+        else:
+            if in_list:
+                processed_lines.append('</ul>')
+                in_list = False
+            processed_lines.append(f'<p>{_format_inline(line)}</p>')
+    
+    if in_list:
+        processed_lines.append('</ul>')
+    
+    return '\n'.join(processed_lines)
+
+
+def render_figure_html(fig):
+    """Render a Plotly figure (object or JSON string) as an embeddable HTML fragment"""
+    if isinstance(fig, str):
+        # It might be JSON format - try to convert
+        try:
+            fig = pio.from_json(fig)
+        except Exception as e:
+            print(f"Warning: Could not process figure JSON: {e}")
+            return None
+    if not hasattr(fig, 'to_html'):
+        return None
+    return fig.to_html(full_html=False, include_plotlyjs=False, config=PLOTLY_CONFIG)
+
+
+def generate_html_report(return_dict):
+    """Generate a clean HTML report focusing on visualizations and key insights"""
+
+    # Convert key text sections to HTML
+    goal = convert_markdown_to_html(return_dict['goal'])
+    questions = convert_markdown_to_html(return_dict['deep_questions'])
+    conclusion = convert_conclusion_to_html(return_dict['final_conclusion'])
+    # Remove duplicate conclusion headings and clean up
+    conclusion = re.sub(r'<p>\s*\*\*\s*Conclusion\s*\*\*\s*</p>', '', conclusion, flags=re.IGNORECASE)
+    conclusion = re.sub(r'<strong>\s*Conclusion\s*</strong>', '', conclusion, flags=re.IGNORECASE)
+    conclusion = re.sub(r'<h[1-6][^>]*>\s*Conclusion\s*</h[1-6]>', '', conclusion, flags=re.IGNORECASE)
+    conclusion = re.sub(r'^\s*Conclusion\s*$', '', conclusion, flags=re.MULTILINE)
+    
+    # Combine synthesis content
+    synthesis_content = ''
+    if return_dict.get('synthesis'):
+        synthesis_content = ''.join(f'<div class="synthesis-section">{convert_markdown_to_html(s)}</div>' 
+                       for s in return_dict['synthesis'])
+
+    # Generate all visualizations for synthesis section
+    all_visualizations = []
+    if return_dict['plotly_figs']:
+        for fig_group in return_dict['plotly_figs']:
+            try:
+                # Entries are either single figures or lists of figures
+                for fig in (fig_group if isinstance(fig_group, list) else (fig_group,)):
+                    fig_html = render_figure_html(fig)
+                    if fig_html is not None:
+                        all_visualizations.append(fig_html)
+            except Exception as e:
+                print(f"Warning: Error processing visualizations: {e}")
+
+    # Prepare code for syntax highlighting; it goes straight into <pre><code>,
+    # so it only needs escaping, not markdown conversion
+    code_content = (return_dict.get('code') or '').strip()
+
+    parts = [
+        REPORT_HEAD,
+        REPORT_QUESTIONS_SECTION.format(goal=goal, questions=questions),
+        REPORT_SYNTHESIS_SECTION.format(synthesis_content=synthesis_content),
+    ]
+    if all_visualizations:
+        parts.extend(f'<div class="visualization-container">{viz}</div>' for viz in all_visualizations)
+    else:
+        parts.append('<p><em>No visualizations generated</em></p>')
+    parts.append('\n            </div>\n\n            ')
+    if code_content:
+        parts.append(REPORT_CODE_SECTION.format(code_content=escape(code_content, quote=False)))
+    parts.append(REPORT_CONCLUSION_SECTION.format(conclusion=conclusion))
+    return ''.join(parts)
@@ -30,19 +30,20 @@ class Logger:
             console_handler.setFormatter(formatter)
             self.logger.addHandler(console_handler)
 
-    def log_message(self, message: str, level: int = logging.INFO):
+    def log_message(self, message: str, level: int = logging.INFO, *args):
+        """Log message at level; extra args are %-formatted lazily, only if the record is emitted"""
         if not self.is_dev:
             return
         if level == logging.INFO:
-            self.logger.info(message)
+            self.logger.info(message, *args)
         elif level == logging.ERROR:
-            self.logger.error(message)
+            self.logger.error(message, *args)
         elif level == logging.WARNING:
-            self.logger.warning(message)
+            self.logger.warning(message, *args)
         elif level == logging.DEBUG:
-            self.logger.debug(message)
+            self.logger.debug(message, *args)
         else:
-            self.logger.info(message)
+            self.logger.info(message, *args)
 
     def disable_logging(self):
         self.logger.disabled = True
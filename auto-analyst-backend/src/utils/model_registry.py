@@ -3,6 +3,8 @@ Models registry for the Auto-Analyst application.
 This file serves as the single source of truth for all model information.
 """
 
+from functools import lru_cache
+
 # Model providers
 PROVIDERS = {
     "openai": "OpenAI",
@@ -53,6 +55,11 @@ MODEL_COSTS = {
     }
 }
 
+# Reverse lookups over MODEL_COSTS, built once at import
+MODEL_TO_PROVIDER = {model: provider for provider, models in MODEL_COSTS.items() for model in models}
+# (input, output) cost per 1K tokens
+MODEL_RATES = {model: (costs["input"], costs["output"]) for models in MODEL_COSTS.values() for model, costs in models.items()}
+
 # Tiers based on cost per 1K tokens
 MODEL_TIERS = {
     "tier1": {
@@ -150,12 +157,17 @@ MODEL_METADATA = {
 
 # Helper functions
 
+@lru_cache(maxsize=256)
 def get_provider_for_model(model_name):
     """Determine the provider based on model name"""
     if not model_name:
         return "Unknown"
         
     model_name = model_name.lower()
+    provider = MODEL_TO_PROVIDER.get(model_name)
+    if provider is not None:
+        return provider
+    # Partial names (e.g. "claude-3") still resolve to the provider of a model containing them
     return next((provider for provider, models in MODEL_COSTS.items() 
                 if any(model_name in model for model in models)), "Unknown")
 
@@ -168,22 +180,13 @@ def get_model_tier(model_name):
 
 def calculate_cost(model_name, input_tokens, output_tokens):
     """Calculate the cost for using the model based on tokens"""
-    if not model_name:
-        return 0
-        
-    # Convert tokens to thousands
-    input_tokens_in_thousands = input_tokens / 1000
-    output_tokens_in_thousands = output_tokens / 1000
-    
-    # Get model provider
-    model_provider = get_provider_for_model(model_name)
-    
     # Handle case where model is not found
-    if model_provider == "Unknown" or model_name not in MODEL_COSTS.get(model_provider, {}):
+    rates = MODEL_RATES.get(model_name) if model_name else None
+    if rates is None:
         return 0
         
-    return (input_tokens_in_thousands * MODEL_COSTS[model_provider][model_name]["input"] + 
-            output_tokens_in_thousands * MODEL_COSTS[model_provider][model_name]["output"])
+    input_rate, output_rate = rates
+    return input_tokens / 1000 * input_rate + output_tokens / 1000 * output_rate
 
 def get_credit_cost(model_name):
     """Get the credit cost for a model"""
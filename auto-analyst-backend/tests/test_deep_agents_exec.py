@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip("dspy")
+pytest.importorskip("pandas")
+pytest.importorskip("plotly")
+
+from src.agents.deep_agents import build_exec_globals, compile_generated_code
+
+# Shaped like agent output: a helper class, attribute lookups and a guarded file read
+GENERATED_SNIPPET = '''
+class ColumnSummary:
+    def __init__(self, frame):
+        self._frame = frame
+
+    @property
+    def rows(self):
+        return len(self._frame)
+
+    @staticmethod
+    def label(name):
+        return chr(ord(name[0]) - 32) + name[1:]
+
+summary = ColumnSummary(pd.DataFrame({"price": [1, 2, 3]}))
+row_count = getattr(summary, "rows")
+label = ColumnSummary.label("price")
+has_locals = "summary" in locals() and "summary" in globals()
+
+try:
+    open("/nonexistent/auto-analyst/data.csv")
+except OSError as e:
+    missing = type(e).__name__
+'''
+
+
+def test_generated_code_runs_with_full_builtins():
+    code_obj = compile_generated_code(GENERATED_SNIPPET)
+    exec_globals = build_exec_globals(code_obj)
+    exec(code_obj, exec_globals)
+
+    assert exec_globals["row_count"] == 3
+    assert exec_globals["label"] == "Price"
+    assert exec_globals["has_locals"] is True
+    assert exec_globals["missing"] == "FileNotFoundError"
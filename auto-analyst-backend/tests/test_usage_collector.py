@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("dotenv")
+
+from src.managers import ai_manager
+from src.managers.ai_manager import UsageCollector
+
+
+@pytest.fixture
+def collector(monkeypatch):
+    async def ignore_broadcast(row):
+        pass
+
+    monkeypatch.setattr(ai_manager, "handle_new_model_usage", ignore_broadcast)
+    # A long flush interval keeps rows buffered until shutdown
+    collector = UsageCollector(max_rows=2, flush_interval=60)
+    collector.written = []
+
+    def write(rows):
+        time.sleep(0.05)  # Keep a batch in flight while aclose() runs
+        collector.written.extend(rows)
+        return True
+
+    collector._write = write
+    return collector
+
+
+def test_aclose_writes_buffered_and_in_flight_rows(collector):
+    async def scenario():
+        for n in range(5):
+            collector.enqueue({"n": n})
+        await asyncio.sleep(0)  # Let the writer pick up its first batch
+        await collector.aclose()
+
+    asyncio.run(scenario())
+    assert sorted(row["n"] for row in collector.written) == list(range(5))
+
+
+def test_enqueue_after_aclose_writes_directly(collector):
+    async def scenario():
+        collector.enqueue({"n": 0})
+        await collector.aclose()
+        collector.enqueue({"n": 1})
+
+    asyncio.run(scenario())
+    assert [row["n"] for row in collector.written] == [0, 1]
+
+
+def test_rows_from_worker_threads_restart_a_stopped_writer(collector):
+    async def scenario():
+        collector.enqueue({"n": 0})
+        collector._writer.cancel()  # Simulate a writer that died
+        await asyncio.sleep(0)
+        await asyncio.to_thread(collector.enqueue, {"n": 1})
+        await asyncio.sleep(0)  # Run the hand-off callback
+        assert not collector._writer.done()
+        await collector.aclose()
+
+    asyncio.run(scenario())
+    assert sorted(row["n"] for row in collector.written) == [0, 1]
+
+
+def test_write_keeps_call_time_and_does_not_modify_rows(monkeypatch):
+    executed = []
+
+    class Connection:
+        def execute(self, statement, rows):
+            executed.extend(rows)
+
+    class Begin:
+        def __enter__(self):
+            return Connection()
+
+        def __exit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(ai_manager.engine, "begin", lambda: Begin())
+    stamped = {"n": 0, "timestamp": "call time"}
+    unstamped = {"n": 1}
+
+    assert UsageCollector()._write([stamped, unstamped])
+    assert executed[0]["timestamp"] == "call time"
+    assert "timestamp" in executed[1]
+    assert "timestamp" not in unstamped